@@ -1,17 +1,24 @@
 import asyncio
 from appbuilder.mcp_server.client import MCPClient
 
+SERVICE_URL = (
+    "http://appbuilder.baidu.com/v2/ai_search/mcp/sse?api_key=bce-v3/ALTAK-Yn3DHHsswoXY17YawiLA9/10a53602a125cff122d8859dc73b4c2cbe5cc4fa"
+)
 
-async def main():
+
+async def main(queries, service_url=SERVICE_URL):
+    """复用同一个MCP连接并发执行多个搜索查询，结果按查询顺序返回"""
     client = MCPClient()
-    await client.connect_to_server(service_url=service_url)
-    print(client.tools)
-    result = await client.call_tool("AIsearch", {"query": "王者荣耀最强", "model": "ernie-3.5-8k"})
-    print(result)
+    try:
+        await client.connect_to_server(service_url=service_url)
+        results = await asyncio.gather(*[
+            client.call_tool("AIsearch", {"query": query, "model": "ernie-3.5-8k"})
+            for query in queries
+        ])
+        return results
+    finally:
+        await client.cleanup()
 
 if __name__ == "__main__":
-    service_url = (
-        "http://appbuilder.baidu.com/v2/ai_search/mcp/sse?api_key=bce-v3/ALTAK-Yn3DHHsswoXY17YawiLA9/10a53602a125cff122d8859dc73b4c2cbe5cc4fa"
-    )
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
\ No newline at end of file
+    for result in asyncio.run(main(["王者荣耀最强"])):
+        print(result)
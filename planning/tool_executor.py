@@ -1,19 +1,48 @@
+import io
 import re
+import asyncio
+import atexit
 import inspect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from docstring_parser import parse
-from typing import List, Optional, Dict, Callable, Annotated
+from typing import List, Optional, Dict, Callable, Annotated, Any
 import datetime
-import time
+import functools
 import os
-import dashscope
+import sys
+import threading
+from http import HTTPStatus
 
 from web.utils.analysis_runner import run_stock_analysis
 import streamlit as st
-import akshare as ak
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from tradingagents.utils.logging_manager import get_logger
+logger = get_logger('planning')
+
+# 6位数字的股票/基金代码
+_SIX_DIGIT_RE = re.compile(r"\b\d{6}\b")
+
+# 报告各部分之间的分隔符
+_REPORT_SEPARATOR = "\n\n"
+
+# 批量分析时同时进行的最大标的数量
+MAX_CONCURRENT_ANALYSES = 5
+
 
 class ToolExecutor:
     """工具执行器，用于管理和执行各种分析工具"""
 
+    # 个股分析报告段落：(state中的键, 段落标题)
+    _REPORT_SECTIONS = [
+        ('market_report', '#### Market Report\n'),
+        ('fundamentals_report', '#### Fundamentals Report\n'),
+        ('sentiment_report', '#### Sentiment Report\n'),
+        ('news_report', '#### News Report\n'),
+    ]
+
     def __init__(self):
         """初始化工具执行器，注册所有可用工具"""
         # 工具注册表，键为工具名称，值为对应的执行方法
@@ -24,6 +53,12 @@ class ToolExecutor:
             # 在这里添加新工具，格式: '工具名称': 执行方法
         }
 
+        # 工具表在注册后即固定，预先生成元信息和工具列表文本
+        self._metadata_cache = {
+            name: self.get_tool_metadata(func) for name, func in self.tools.items()
+        }
+        self._tools_text = self._format_available_tools()
+
     def get_available_tools(self):
         """获取所有可用工具的列表"""
         return list(self.tools.keys())
@@ -31,48 +66,19 @@ class ToolExecutor:
     @staticmethod
     def get_tool_metadata(tool_func):
         """提取工具函数的元信息（名称、描述、参数列表）"""
-        # 1. 基础信息：函数名和 docstring 摘要
-        tool_name = tool_func.__name__
-        docstring = inspect.getdoc(tool_func) or ""
-        parsed_doc = parse(docstring)  # 解析docstring
-        tool_description = parsed_doc.short_description or "无描述"
-
-        # 2. 提取参数信息：结合函数签名和docstring参数描述
-        sig = inspect.signature(tool_func)  # 获取函数签名
-        parameters = []
-        for param_name, param in sig.parameters.items():
-            # 从签名中获取参数类型、默认值
-            param_type = param.annotation.__name__ if param.annotation != inspect.Parameter.empty else "未指定"
-            default_value = param.default if param.default != inspect.Parameter.empty else "必填"
-
-            # 从docstring中获取参数描述（适配Google风格的Args）
-            param_desc = ""
-            for doc_param in parsed_doc.params:
-                if doc_param.arg_name == param_name:
-                    param_desc = doc_param.description or "无描述"
-                    break
-
-            parameters.append({
-                "name": param_name,
-                "type": param_type,
-                "default": default_value,
-                "description": param_desc
-            })
-
-        return {
-            "name": tool_name,
-            "description": tool_description,
-            "parameters": parameters
-        }
+        # 绑定方法随实例变化，按底层函数缓存解析结果，使其在所有实例间共享
+        return _parse_tool_metadata(getattr(tool_func, '__func__', tool_func), inspect.ismethod(tool_func))
 
     def generate_available_tools(self):
         """生成包含参数信息的可用工具列表"""
-        # 修复：获取工具函数而不是工具名称字符串
+        return self._tools_text
+
+    def _format_available_tools(self):
+        """根据工具元信息格式化可用工具列表"""
         tool_list = []
 
-        # 枚举所有工具（名称和对应的函数）
-        for idx, (tool_display_name, tool_func) in enumerate(self.tools.items(), 1):
-            metadata = ToolExecutor.get_tool_metadata(tool_func)
+        # 枚举所有工具（名称和对应的元信息）
+        for idx, (tool_display_name, metadata) in enumerate(self._metadata_cache.items(), 1):
             # 格式化工具基本信息
             tool_info = [
                 f"{idx}. 工具名称：{tool_display_name}",  # 使用显示名称
@@ -112,12 +118,12 @@ class ToolExecutor:
         except Exception as e:
             return f"执行工具 '{tool_name}' 时发生错误: {str(e)}"
 
-    def _extract_stock_symbols(self, parameters: Dict, step_content: str) -> List[str]:
-        """从参数或步骤文本中提取6位数字的股票代码"""
+    def _extract_symbols(self, parameters: Dict, step_content: str, key: str) -> List[str]:
+        """从参数或步骤文本中提取6位数字的证券代码（key 为 "stock_symbols" 或 "fund_symbols"）"""
         candidates = []
         # 1. 从parameters中提取（优先）
-        if isinstance(parameters, dict) and "stock_symbols" in parameters:
-            param_value = parameters["stock_symbols"]
+        if isinstance(parameters, dict) and key in parameters:
+            param_value = parameters[key]
             if isinstance(param_value, list):
                 candidates.extend([str(code) for code in param_value])
             else:
@@ -127,27 +133,8 @@ class ToolExecutor:
         if not candidates and step_content:
             candidates.append(step_content)
 
-        # 3. 过滤有效代码（6位数字）
-        valid_codes = list(set(re.findall(r"\b\d{6}\b", ",".join(candidates))))  # 去重+匹配6位数字
-        return sorted(valid_codes)  # 排序后返回
-
-    def _extract_fund_symbols(self, parameters: Dict, step_content: str) -> List[str]:
-        """从参数或步骤文本中提取6位数字的基金代码"""
-        candidates = []
-        # 1. 从parameters中提取（优先）
-        if isinstance(parameters, dict) and "fund_symbols" in parameters:
-            param_value = parameters["fund_symbols"]
-            if isinstance(param_value, list):
-                candidates.extend([str(code) for code in param_value])
-            else:
-                candidates.append(str(param_value))  # 支持单个代码的情况
-
-        # 2. 从step_content中提取（补充）
-        if not candidates and step_content:
-            candidates.append(step_content)
-
-        # 3. 过滤有效代码（6位数字）
-        valid_codes = list(set(re.findall(r"\b\d{6}\b", ",".join(candidates))))  # 去重+匹配6位数字
+        # 3. 过滤有效代码（6位数字），逐个候选匹配，无需拼接整段文本
+        valid_codes = {code for candidate in candidates for code in _SIX_DIGIT_RE.findall(candidate)}  # 去重
         return sorted(valid_codes)  # 排序后返回
 
     def execute_stock_analysis_tool(
@@ -168,62 +155,76 @@ class ToolExecutor:
             整合后的股票分析报告，包含每只股票的市场、基本面等分析内容
         """
         # 提取股票代码
-        stock_symbols = self._extract_stock_symbols(parameters, step_content)
+        stock_symbols = self._extract_symbols(parameters, step_content, "stock_symbols")
         if not stock_symbols:
             return "错误：未找到有效的A股股票代码（需为6位数字），无法执行分析。"
 
         # 获取LLM配置
         llm_provider = st.session_state.llm_config.get('llm_provider', 'dashscope')
         llm_model = st.session_state.llm_config.get('llm_model', 'qwen-plus')
-
-        all_analysis = []
-        total = len(stock_symbols)
-
-        for i, code in enumerate(stock_symbols, 1):
-            # 进度反馈
-            if progress_callback:
-                progress = i / total
-                progress_callback(f"正在分析股票 {code}（{i}/{total}）", progress)
+        # 整批使用同一分析日期，跨零点执行时缓存键也保持一致
+        analysis_date = str(datetime.date.today())
+
+        def analyze(code, notify):
+            return _cached_stock_analysis(
+                stock_symbol=code,
+                analysis_date=analysis_date,
+                research_depth=1,
+                llm_provider=llm_provider,
+                llm_model=llm_model,
+                _progress_callback=lambda message, *_: notify(f"股票 {code}: {message}"),
+            )
+
+        # 本会话中已成功分析过的股票直接复用报告，只分析尚未分析过的代码
+        report_cache = st.session_state.setdefault('stock_report_cache', {})
+
+        def cache_key(code):
+            return code, analysis_date, llm_provider, llm_model
+
+        pending = [code for code in stock_symbols if cache_key(code) not in report_cache]
+        outcomes = self._run_batch(pending, analyze, "股票", progress_callback) if pending else []
+
+        reports = {}
+        for code, analysis_result in zip(pending, outcomes):
+            if isinstance(analysis_result, Exception):
+                # 失败结果不写入缓存，下次调用时重新分析
+                reports[code] = f"### 个股分析: {code}\n分析失败：{str(analysis_result)}"
+                continue
 
             try:
-                # 执行股票分析
-                analysis_result = run_stock_analysis(
-                    stock_symbol=code,
-                    analysis_date=str(datetime.date.today()),
-                    analysts=['fundamentals'],
-                    research_depth=1,
-                    llm_provider=llm_provider,
-                    llm_model=llm_model,
-                    market_type='A股',
-                )
+                report = self._format_stock_report(code, analysis_result)
             except Exception as e:
-                all_analysis.append(f"### 个股分析: {code}\n分析失败：{str(e)}")
+                # 单只股票的报告整合出错只影响该股票，且不写入缓存
+                reports[code] = f"### 个股分析: {code}\n分析失败：报告整合出错：{str(e)}"
                 continue
-
-            # 处理分析结果
-            raw_reports = []
-            if 'state' in analysis_result:
-                state = analysis_result['state']
-                report_types = [
-                    'market_report', 'fundamentals_report',
-                    'sentiment_report', 'news_report',
-                ]
-                for report_type in report_types:
-                    if report_type in state:
-                        raw_reports.append(
-                            f"#### {report_type.replace('_', ' ').title()}\n{state[report_type]}")
-
-            # 添加决策推理
-            decision_reasoning = ""
-            if 'decision' in analysis_result and 'reasoning' in analysis_result['decision']:
-                decision_reasoning = f"#### 核心决策结论\n{analysis_result['decision']['reasoning']}"
-
-            # 整合报告
-            full_raw_report = "\n\n".join(raw_reports + [decision_reasoning])
-            all_analysis.append(
-                f"### 个股分析: {code}\n{full_raw_report if full_raw_report else '无分析结果'}")
-
-        return "\n\n".join(all_analysis)
+            reports[code] = report_cache[cache_key(code)] = report
+
+        return _REPORT_SEPARATOR.join(
+            reports[code] if code in reports else report_cache[cache_key(code)]
+            for code in stock_symbols
+        )
+
+    def _format_stock_report(self, code, analysis_result):
+        """将单只股票的分析结果整合为报告文本"""
+        # 各段落直接写入缓冲区，不再拼接中间列表和字符串
+        buf = io.StringIO()
+        separator = ""
+        state = analysis_result.get('state', {})
+        for key, header in self._REPORT_SECTIONS:
+            if key in state:
+                buf.write(separator)
+                buf.write(header)
+                buf.write(str(state[key]))
+                separator = _REPORT_SEPARATOR
+
+        # 添加决策推理（来自大模型输出，可能为 None 等非字符串值）
+        if 'decision' in analysis_result and 'reasoning' in analysis_result['decision']:
+            buf.write(separator)
+            buf.write("#### 核心决策结论\n")
+            buf.write(str(analysis_result['decision']['reasoning']))
+
+        full_raw_report = buf.getvalue()
+        return f"### 个股分析: {code}\n{full_raw_report if full_raw_report else '无分析结果'}"
 
     def execute_fund_analysis_tool(
         self,
@@ -243,183 +244,560 @@ class ToolExecutor:
             整合后的基金分析报告，包含每只基金的市场、基本面等分析内容
         """
         # 提取基金代码
-        fund_symbols = self._extract_fund_symbols(parameters, step_content)
+        fund_symbols = self._extract_symbols(parameters, step_content, "fund_symbols")
         if not fund_symbols:
             return "错误：未找到有效的基金代码（需为6位数字），无法执行分析。"
 
         # 获取LLM配置
         llm_provider = st.session_state.llm_config.get('llm_provider', 'dashscope')
         llm_model = st.session_state.llm_config.get('llm_model', 'qwen-plus')
+        # 整批使用同一分析日期，跨零点执行时缓存键也保持一致
+        analysis_date = str(datetime.date.today())
 
-        all_analysis = []
-        total = len(fund_symbols)
+        def analyze(code, notify):
+            return _analyze_fund(code, analysis_date, on_progress=notify)
 
-        for i, code in enumerate(fund_symbols, 1):
-            # 进度反馈
-            if progress_callback:
-                progress = i / total
-                progress_callback(f"正在分析基金 {code}（{i}/{total}）", progress)
+        # 本会话中已成功分析过的基金直接复用报告，只分析尚未分析过的代码
+        report_cache = st.session_state.setdefault('fund_report_cache', {})
 
-            try:
-                # 执行基金分析
-                analysis_result = run_fund_analysis(
-                    fund_symbol=code )
-            except Exception as e:
-                all_analysis.append(f"### 基金分析: {code}\n分析失败：{str(e)}")
+        def cache_key(code):
+            return code, analysis_date
+
+        pending = [code for code in fund_symbols if cache_key(code) not in report_cache]
+        outcomes = self._run_batch(pending, analyze, "基金", progress_callback) if pending else []
+
+        reports = {}
+        for code, analysis_result in zip(pending, outcomes):
+            if isinstance(analysis_result, Exception):
+                # 失败结果不写入缓存，下次调用时重新分析
+                reports[code] = f"### 基金分析: {code}\n分析失败：{str(analysis_result)}"
                 continue
 
-            all_analysis.append(
-                f"### 基金分析: {code}\n{analysis_result if analysis_result else '无分析结果'}")
+            report, complete = analysis_result
+            reports[code] = f"### 基金分析: {code}\n{report if report else '无分析结果'}"
+            if complete:
+                # 部分数据获取失败的报告不写入缓存，下次调用时重新分析
+                report_cache[cache_key(code)] = reports[code]
 
-        return "\n\n".join(all_analysis)
+        return _REPORT_SEPARATOR.join(
+            reports[code] if code in reports else report_cache[cache_key(code)] for code in fund_symbols
+        )
 
-def run_fund_analysis(fund_symbol):
-    # 构建报告头
-    result = f"【基金代码】: {fund_symbol}\n"
+    @staticmethod
+    def _run_batch(
+            symbols: List[str],
+            worker: Callable[[str, Callable[[str], None]], Any],
+            label: str,
+            progress_callback: Optional[Callable[[str, float], None]] = None
+    ) -> List[Any]:
+        """
+        并发执行批量分析，结果按输入顺序返回
 
-    # 1. 基本数据
-    try:
-        basic_info = ak.fund_individual_basic_info_xq(symbol=fund_symbol)
-        result += "【基本数据】:\n" + basic_info.to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【基本数据】获取失败: {str(e)}\n\n"
+        每个标的的分析在线程池中执行，并发数由信号量限制为 MAX_CONCURRENT_ANALYSES；
+        进度回调只在事件循环所在的调用线程中触发，保证进度单调递增，
+        工作线程中的中间进度通过 notify 转交给事件循环线程。
 
-    # 2. 基金评级
-    try:
-        fund_rating_all_df = ak.fund_rating_all()
-        result += "【基金评级】:\n" + fund_rating_all_df[
-            fund_rating_all_df['代码'] == fund_symbol
-            ].to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【基金评级】获取失败: {str(e)}\n\n"
+        Args:
+            symbols: 待分析的代码列表
+            worker: 单个代码的分析函数（阻塞调用），接收代码和 notify(进度信息) 两个参数
+            label: 进度信息中的标的类别，如 "股票"、"基金"
+            progress_callback: 进度回调函数
 
-    # 3. 业绩表现（前5条）
+        Returns:
+            与 symbols 一一对应的分析结果，执行失败的位置为对应的异常对象
+        """
+        total = len(symbols)
+        done = 0
+
+        async def run_all():
+            nonlocal done
+            loop = asyncio.get_running_loop()
+            sem = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+
+            def report(message):
+                # 在事件循环线程上读取 done，保证进度值与完成提示一致、单调不减
+                progress_callback(message, done / total)
+
+            def notify(message):
+                if progress_callback:
+                    loop.call_soon_threadsafe(report, message)
+
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_ANALYSES) as pool:
+                async def run_one(idx, code):
+                    async with sem:
+                        # 获得并发名额、即将开始分析时反馈进度
+                        if progress_callback:
+                            progress_callback(f"正在分析{label} {code}（已完成 {done}/{total}）", done / total)
+                        try:
+                            return idx, await loop.run_in_executor(pool, worker, code, notify)
+                        except Exception as e:
+                            return idx, e
+
+                results = []
+                tasks = [run_one(idx, code) for idx, code in enumerate(symbols)]
+                for next_result in asyncio.as_completed(tasks):
+                    idx, outcome = await next_result
+                    results.append((idx, outcome))
+                    done += 1
+                    # 进度反馈
+                    if progress_callback:
+                        progress_callback(f"已完成{label} {symbols[idx]} 的分析（{done}/{total}）", done / total)
+
+            results.sort(key=lambda pair: pair[0])
+            return [outcome for _, outcome in results]
+
+        return asyncio.run(run_all())
+
+
+# 同一交易日内对同一标的的分析结果缓存时长（秒）
+ANALYSIS_CACHE_TTL = 6 * 3600
+
+
+@st.cache_data(ttl=ANALYSIS_CACHE_TTL, show_spinner=False)
+def _cached_stock_analysis(stock_symbol, analysis_date, research_depth, llm_provider, llm_model,
+                           _progress_callback=None):
+    """
+    按 (股票代码, 分析日期, 研究深度, 模型) 缓存个股报告文本，分析失败或仅得到演示数据时抛出异常且不缓存；
+    _progress_callback 以下划线开头，不参与缓存键
+    """
+    analysis_result = run_stock_analysis(
+        stock_symbol=stock_symbol,
+        analysis_date=analysis_date,
+        analysts=['fundamentals'],
+        research_depth=research_depth,
+        llm_provider=llm_provider,
+        llm_model=llm_model,
+        market_type='A股',
+        progress_callback=_progress_callback,
+    )
+    if analysis_result.get('success') is False:
+        raise RuntimeError(analysis_result.get('error', '未知错误'))
+    # 真实分析异常时 run_stock_analysis 会返回随机生成的演示数据，不能当作真实报告缓存
+    if analysis_result.get('is_demo'):
+        raise RuntimeError(analysis_result.get('demo_reason') or '分析失败，仅返回了演示数据')
+
+    # 只缓存报告用到的文本，完整的分析状态体积大且未必可序列化
+    state = analysis_result.get('state') or {}
+    decision = analysis_result.get('decision')
+    return {
+        'state': {key: state[key] for key, _ in ToolExecutor._REPORT_SECTIONS if key in state},
+        'decision': {'reasoning': decision['reasoning']}
+        if isinstance(decision, dict) and 'reasoning' in decision else {},
+    }
+
+
+class IncompleteFundReport(Exception):
+    """基于部分数据生成的基金报告，可以展示但不应缓存"""
+
+    def __init__(self, report):
+        super().__init__("基金数据不完整")
+        self.report = report
+
+
+@st.cache_data(ttl=ANALYSIS_CACHE_TTL, show_spinner=False)
+def _cached_fund_analysis(fund_symbol, analysis_date, _on_progress=None):
+    """
+    按 (基金代码, 分析日期) 缓存基金分析报告；_on_progress 以下划线开头，不参与缓存键
+
+    数据不完整的报告以 IncompleteFundReport 异常带出，st.cache_data 不缓存异常结果
+    """
+    report, complete = run_fund_analysis(fund_symbol, on_progress=_on_progress)
+    if not complete:
+        raise IncompleteFundReport(report)
+    return report
+
+
+def _analyze_fund(fund_symbol, analysis_date, on_progress=None):
+    """
+    分析单只基金，数据完整的报告走缓存，不完整的报告直接返回不缓存
+
+    Returns:
+        (报告文本, 数据是否完整)
+    """
     try:
-        achievement = ak.fund_individual_achievement_xq(symbol=fund_symbol)
-        result += "【业绩表现】:\n" + achievement.head(5).to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【业绩表现】获取失败: {str(e)}\n\n"
-
-    # 4. 净值估算（特殊处理全量请求）
+        return _cached_fund_analysis(fund_symbol, analysis_date, _on_progress=on_progress), True
+    except IncompleteFundReport as e:
+        return e.report, False
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_tool_metadata(func, bound):
+    """解析函数签名与docstring得到工具元信息，结果按函数缓存"""
+    # 1. 基础信息：函数名和 docstring 摘要
+    tool_name = func.__name__
+    docstring = inspect.getdoc(func) or ""
+    parsed_doc = parse(docstring)  # 解析docstring
+    tool_description = parsed_doc.short_description or "无描述"
+
+    # 2. 提取参数信息：结合函数签名和docstring参数描述
+    sig_params = list(inspect.signature(func).parameters.items())  # 获取函数签名
+    if bound:
+        sig_params = sig_params[1:]  # 绑定方法不对外暴露 self
+    parameters = []
+    for param_name, param in sig_params:
+        # 从签名中获取参数类型、默认值
+        param_type = param.annotation.__name__ if param.annotation != inspect.Parameter.empty else "未指定"
+        default_value = param.default if param.default != inspect.Parameter.empty else "必填"
+
+        # 从docstring中获取参数描述（适配Google风格的Args）
+        param_desc = ""
+        for doc_param in parsed_doc.params:
+            if doc_param.arg_name == param_name:
+                param_desc = doc_param.description or "无描述"
+                break
+
+        parameters.append({
+            "name": param_name,
+            "type": param_type,
+            "default": default_value,
+            "description": param_desc
+        })
+
+    return {
+        "name": tool_name,
+        "description": tool_description,
+        "parameters": parameters
+    }
+
+
+# 临时性错误（限流/服务端错误/网络错误）的重试策略：最多尝试5次，带抖动的指数退避。
+# 注意：akshare 内部直接调用 r.json() 而不检查状态码，其返回的 429/5xx 通常表现为解析错误而不会重试，
+# 对 akshare 实际生效的只有连接错误和超时
+RETRY_MAX_ATTEMPTS = 5
+_RETRY_BACKOFF = wait_random_exponential(multiplier=0.5, max=8)
+_RETRY_AFTER_MAX_SECONDS = 60
+
+
+class TransientAPIError(Exception):
+    """可重试的临时性接口错误，如大模型接口的限流（429）或服务端错误（5xx）"""
+
+
+def _is_transient_error(exc):
+    """判断异常是否为值得重试的临时性错误"""
+    if isinstance(exc, (TransientAPIError, requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+
+def _retry_wait(retry_state):
+    """计算重试等待时间：服务端给出 Retry-After 时遵循之，否则使用带抖动的指数退避"""
+    exc = retry_state.outcome.exception()
+    retry_after = None
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        retry_after = exc.response.headers.get('Retry-After')
     try:
-        fund_value_df = ak.fund_value_estimation_em(symbol="全部")
-        result += "【净值估算】:\n" + fund_value_df[
-            fund_value_df['基金代码'] == fund_symbol
-            ].to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【净值估算】获取失败: {str(e)}\n\n"
+        return min(float(retry_after), _RETRY_AFTER_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return _RETRY_BACKOFF(retry_state)
+
+
+def _call_with_retry(fn, *args, description="", on_retry=None, **kwargs):
+    """
+    调用接口，遇到临时性错误时按退避策略重试，重试耗尽后抛出最后一次的异常
+
+    Args:
+        fn: 被调用的函数
+        description: 日志和重试提示中使用的调用描述
+        on_retry: 重试回调，接收重试提示信息（str）
+    """
+    def before_sleep(retry_state):
+        message = (f"{description}请求失败（{retry_state.outcome.exception()}），"
+                   f"{retry_state.next_action.sleep:.1f}秒后进行第{retry_state.attempt_number}次重试")
+        logger.warning(message)
+        if on_retry:
+            on_retry(message)
+
+    retrying = Retrying(
+        retry=retry_if_exception(_is_transient_error),
+        wait=_retry_wait,
+        stop=stop_after_attempt(RETRY_MAX_ATTEMPTS),
+        before_sleep=before_sleep,
+        reraise=True,
+    )
+    return retrying(fn, *args, **kwargs)
 
-    # 5. 数据分析
-    try:
-        analysis = ak.fund_individual_analysis_xq(symbol=fund_symbol)
-        result += "【数据分析】:\n" + analysis.to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【数据分析】获取失败: {str(e)}\n\n"
 
-    # 6. 盈利概率
-    try:
-        profit_prob = ak.fund_individual_profit_probability_xq(symbol=fund_symbol)
-        result += "【盈利概率】:\n" + profit_prob.to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【盈利概率】获取失败: {str(e)}\n\n"
+# akshare 单个数据源的最大并发请求数，替代原先串行请求之间的 time.sleep 限流
+AKSHARE_MAX_CONCURRENT_PER_HOST = 3
+_AKSHARE_HOST_SEMAPHORES = {
+    'xq': threading.Semaphore(AKSHARE_MAX_CONCURRENT_PER_HOST),  # 雪球/蛋卷基金
+    'em': threading.Semaphore(AKSHARE_MAX_CONCURRENT_PER_HOST),  # 东方财富
+}
 
-    # 7. 持仓资产比例
-    try:
-        detail_hold = ak.fund_individual_detail_hold_xq(symbol=fund_symbol)
-        result += "【持仓资产比例】:\n" + detail_hold.to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【持仓资产比例】获取失败: {str(e)}\n\n"
+# akshare 基金接口共用的 HTTP 会话：复用连接池，避免每次请求都重新建立 TCP/TLS 连接
+AKSHARE_POOL_SIZE = 20
+_AKSHARE_SESSION = requests.Session()
+_AKSHARE_SESSION.mount("https://", HTTPAdapter(pool_connections=AKSHARE_POOL_SIZE, pool_maxsize=AKSHARE_POOL_SIZE))
+_AKSHARE_SESSION.mount("http://", HTTPAdapter(pool_connections=AKSHARE_POOL_SIZE, pool_maxsize=AKSHARE_POOL_SIZE))
+# 会话由进程内所有用户会话的批量分析共用，只在进程退出时关闭
+atexit.register(_AKSHARE_SESSION.close)
 
-    # 8. 行业配置（2025年数据）
-    try:
-        industry_alloc = ak.fund_portfolio_industry_allocation_em(symbol=fund_symbol, date="2025")
-        result += "【行业配置】:\n" + industry_alloc.to_string(index=False) + "\n\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【行业配置】获取失败: {str(e)}\n\n"
 
+class _SessionRequests:
+    """替换 akshare 模块内的 requests 引用：get/post 走共享会话，其余属性仍取自 requests"""
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        return _AKSHARE_SESSION.request(method, url, **kwargs)
+
+    @staticmethod
+    def get(url, params=None, **kwargs):
+        return _AKSHARE_SESSION.get(url, params=params, **kwargs)
+
+    @staticmethod
+    def post(url, data=None, json=None, **kwargs):
+        return _AKSHARE_SESSION.post(url, data=data, json=json, **kwargs)
+
+
+def _route_akshare_through_session():
+    """让 akshare 基金模块的 HTTP 请求经由共享会话发出（akshare 未提供传入 session 的接口）"""
+    session_requests = _SessionRequests()
+    for name, module in list(sys.modules.items()):
+        if name.startswith('akshare.fund') and getattr(module, 'requests', None) is requests:
+            module.requests = session_requests
+
+
+# akshare 与 dashscope 导入耗时较长，延迟到首次使用基金分析时再加载
+_ak = None
+_dashscope = None
+
+
+def _get_akshare():
+    """首次调用时导入 akshare，并让其基金接口使用共享会话"""
+    global _ak
+    if _ak is None:
+        import akshare
+        _route_akshare_through_session()
+        _ak = akshare
+    return _ak
+
+
+def _get_dashscope():
+    """首次调用时导入 dashscope"""
+    global _dashscope
+    if _dashscope is None:
+        import dashscope
+        _dashscope = dashscope
+    return _dashscope
+
+# 基金数据分段：(段落标题, 数据源, 获取函数)，报告按此顺序拼接
+_FUND_SECTIONS = [
+    # 1. 基本数据
+    ("基本数据", 'xq', lambda symbol: _get_akshare().fund_individual_basic_info_xq(symbol=symbol)),
+    # 2. 基金评级
+    ("基金评级", 'em', lambda symbol: _lookup_by_code(_cached_fund_rating_all(), symbol)),
+    # 3. 业绩表现（前5条）
+    ("业绩表现", 'xq', lambda symbol: _get_akshare().fund_individual_achievement_xq(symbol=symbol).head(5)),
+    # 4. 净值估算（特殊处理全量请求）
+    ("净值估算", 'em', lambda symbol: _lookup_by_code(_cached_fund_value_estimation_all(), symbol)),
+    # 5. 数据分析
+    ("数据分析", 'xq', lambda symbol: _get_akshare().fund_individual_analysis_xq(symbol=symbol)),
+    # 6. 盈利概率
+    ("盈利概率", 'xq', lambda symbol: _get_akshare().fund_individual_profit_probability_xq(symbol=symbol)),
+    # 7. 持仓资产比例
+    ("持仓资产比例", 'xq', lambda symbol: _get_akshare().fund_individual_detail_hold_xq(symbol=symbol)),
+    # 8. 行业配置（2025年数据）
+    ("行业配置", 'em', lambda symbol: _get_akshare().fund_portfolio_industry_allocation_em(symbol=symbol, date="2025")),
     # 9. 基金持仓（2025年数据）
-    try:
-        portfolio_hold = ak.fund_portfolio_hold_em(symbol=fund_symbol, date="2025")
-        result += "【基金持仓】:\n" + portfolio_hold.to_string(index=False) + "\n"
-        time.sleep(1)
-    except Exception as e:
-        result += f"【基金持仓】获取失败: {str(e)}\n"
-
-    print(result)
-
-    system_message = (
-        f"你是一位专业的基金基本面分析师。\n"
-        f"任务：对（基金代码：{fund_symbol}）进行全面基本面分析\n"
-        "📊 **强制要求：**\n"
-        "按以下框架输出结构化报告：\n\n"
-
-        "### 一、基金产品基础分析\n"
-        "- **基金公司实力**：管理规模排名、权益投资能力评级、风控体系完善度\n"
-        "- **基金经理**：从业年限、历史年化回报、最大回撤控制能力（近3年）、投资风格稳定性\n"
-        "- **产品特性**：基金类型(股票/混合/债券)、运作方式(开放式/封闭式)、规模变动趋势(警惕＜1亿清盘风险)\n"
-        "- **费率结构**：管理费+托管费总成本、浮动费率机制(如有)、申购赎回费率\n\n"
-
-        "### 二、风险收益特征分析\n"
-        "- **核心指标**：\n"
-        "  • 夏普比率(＞1为优)、卡玛比率(年化收益/最大回撤，＞0.5合格)\n"
-        "  • 波动率(同类排名后30%为佳)、下行捕获率(＜100%表明抗跌)\n"
-        "- **极端风险控制**：\n"
-        "  • 最大回撤率(数值绝对值越小越好)及修复时长\n"
-        "  • 股灾/熊市期间表现(如2022年回撤幅度 vs 沪深300)\n\n"
-
-        "### 三、长期业绩评估\n"
-        "- **收益维度**：\n"
-        "  • 3年/5年年化收益率(需扣除费率)、超额收益(Alpha)\n"
-        "  • 业绩持续性：每年排名同类前50%的年份占比\n"
-        "- **基准对比**：\n"
-        "  • 滚动3年跑赢业绩比较基准的概率\n"
-        "  • 不同市场环境适应性(如2023成长牛 vs 2024价值修复行情表现)\n\n"
-
-        "### 四、综合价值评估\n"
-        "- **持仓穿透估值**：\n"
-        "  • 股票部分：前十大重仓股PE/PB分位数(行业调整后)\n"
-        "  • 债券部分：信用债利差水平、利率债久期风险\n"
-        "- **组合性价比**：\n"
-        "  • 股债净资产比价(E/P - 10年国债收益率)\n"
-        "  • 场内基金需分析折溢价率(＞1%警惕高估)\n"
-        f"- **绝对价值锚点**：给出合理净值区间依据：\n"
-        "  当前净值水平 vs 历史波动区间(30%分位以下为低估)\n\n"
-
-        "### 五、投资决策建议\n"
-        "- **建议逻辑**：\n"
-        "  • 综合夏普比率＞1.2+卡玛比率＞0.7+净值处30%分位→'买入'\n"
-        "  • 规模激增(＞100亿)+重仓股估值＞70%分位→'减持'\n"
-        "- **强制输出**：中文操作建议(买入/增持/持有/减持/卖出)\n"
-
-        "🚫 **禁止事项**：\n"
-        "- 禁止假设数据\n"
-        "- 禁止使用英文建议(buy/sell/hold)\n"
-    )
+    ("基金持仓", 'em', lambda symbol: _get_akshare().fund_portfolio_hold_em(symbol=symbol, date="2025")),
+]
 
-    user_prompt = (f"你现在拥有以下基金的真实数据，请严格依赖真实数据（注意！每条数据必须强制利用到来进行分析），"
-                   f"绝不编造其他数据，对（基金代码：{fund_symbol}）进行全面分析，给出非常详细格式化的报告:\n")
-    user_prompt += result
 
-    messages = [
-        {'role': 'system', 'content': system_message},
-        {'role': 'user', 'content': user_prompt}
-    ]
-    response = dashscope.Generation.call(
+# 全市场表以基金代码为索引后只读共享：用 cache_resource 而非 cache_data，
+# 避免每次读取都反序列化出新副本并重建索引
+@st.cache_resource(ttl=3600, show_spinner=False)
+def _cached_fund_rating_all():
+    """全市场基金评级表（以基金代码为索引），批量分析时各基金共用，避免重复下载"""
+    return _get_akshare().fund_rating_all().set_index('代码', drop=False)
+
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def _cached_fund_value_estimation_all():
+    """全市场基金净值估算表（以基金代码为索引），批量分析时各基金共用，避免重复下载"""
+    return _get_akshare().fund_value_estimation_em(symbol="全部").set_index('基金代码', drop=False)
+
+
+def _lookup_by_code(df, fund_symbol):
+    """按基金代码索引查找对应行，代码不存在时返回空表"""
+    if fund_symbol in df.index:
+        return df.loc[[fund_symbol]]
+    return df.iloc[0:0]
+
+
+# 宽表段落只保留与分析相关的列，减少提示词 token；
+# 持仓和行业配置按季度返回多期数据，保留季度/截止时间列以区分报告期
+_SECTION_COLUMNS = {
+    "数据分析": ["周期", "较同类风险收益比", "较同类抗风险波动", "年化波动率", "年化夏普比率", "最大回撤"],
+    "行业配置": ["行业类别", "占净值比例", "市值", "截止时间"],
+    "基金持仓": ["股票代码", "股票名称", "占净值比例", "持股数", "持仓市值", "季度"],
+}
+
+
+def _project_columns(title, df):
+    """按段落的列白名单裁剪数据表；白名单列均不存在（如接口字段变更）时保留原表"""
+    columns = [column for column in _SECTION_COLUMNS.get(title, []) if column in df.columns]
+    return df[columns] if columns else df
+
+
+def _format_table(df):
+    """将数据表格式化为以 | 分隔的文本，比 to_string 更快且更省 token"""
+    if df.empty:
+        return "无数据"
+    return df.to_csv(sep='|', index=False).rstrip("\n")
+
+
+def _fetch_fund_section(host, fetch, fund_symbol):
+    """在数据源并发限制下获取单个分段数据"""
+    with _AKSHARE_HOST_SEMAPHORES[host]:
+        return fetch(fund_symbol)
+
+
+def _fetch_fund_data(fund_symbol, on_progress=None):
+    """并发获取基金的各分段数据（临时性错误自动重试），按固定顺序拼接为文本，并返回成功获取的分段数"""
+    sections = {}
+    succeeded = 0
+    with ThreadPoolExecutor(max_workers=len(_FUND_SECTIONS)) as pool:
+        futures = {
+            pool.submit(_call_with_retry, _fetch_fund_section, host, fetch, fund_symbol,
+                        description=f"基金 {fund_symbol} 的{title}", on_retry=on_progress): title
+            for title, host, fetch in _FUND_SECTIONS
+        }
+        for future in as_completed(futures):
+            title = futures[future]
+            try:
+                sections[title] = "【" + title + "】:\n" + _format_table(_project_columns(title, future.result()))
+                succeeded += 1
+            except Exception as e:
+                sections[title] = f"【{title}】获取失败: {str(e)}"
+
+    # 构建报告头
+    result = f"【基金代码】: {fund_symbol}\n"
+    result += "\n\n".join(sections[title] for title, _, _ in _FUND_SECTIONS) + "\n"
+    return result, succeeded
+
+
+# 基金分析提示词模板，仅 {fund_symbol} 为动态字段
+_FUND_SYSTEM_TEMPLATE = (
+    "你是一位专业的基金基本面分析师。\n"
+    "任务：对（基金代码：{fund_symbol}）进行全面基本面分析\n"
+    "📊 **强制要求：**\n"
+    "按以下框架输出结构化报告：\n\n"
+
+    "### 一、基金产品基础分析\n"
+    "- **基金公司实力**：管理规模排名、权益投资能力评级、风控体系完善度\n"
+    "- **基金经理**：从业年限、历史年化回报、最大回撤控制能力（近3年）、投资风格稳定性\n"
+    "- **产品特性**：基金类型(股票/混合/债券)、运作方式(开放式/封闭式)、规模变动趋势(警惕＜1亿清盘风险)\n"
+    "- **费率结构**：管理费+托管费总成本、浮动费率机制(如有)、申购赎回费率\n\n"
+
+    "### 二、风险收益特征分析\n"
+    "- **核心指标**：\n"
+    "  • 夏普比率(＞1为优)、卡玛比率(年化收益/最大回撤，＞0.5合格)\n"
+    "  • 波动率(同类排名后30%为佳)、下行捕获率(＜100%表明抗跌)\n"
+    "- **极端风险控制**：\n"
+    "  • 最大回撤率(数值绝对值越小越好)及修复时长\n"
+    "  • 股灾/熊市期间表现(如2022年回撤幅度 vs 沪深300)\n\n"
+
+    "### 三、长期业绩评估\n"
+    "- **收益维度**：\n"
+    "  • 3年/5年年化收益率(需扣除费率)、超额收益(Alpha)\n"
+    "  • 业绩持续性：每年排名同类前50%的年份占比\n"
+    "- **基准对比**：\n"
+    "  • 滚动3年跑赢业绩比较基准的概率\n"
+    "  • 不同市场环境适应性(如2023成长牛 vs 2024价值修复行情表现)\n\n"
+
+    "### 四、综合价值评估\n"
+    "- **持仓穿透估值**：\n"
+    "  • 股票部分：前十大重仓股PE/PB分位数(行业调整后)\n"
+    "  • 债券部分：信用债利差水平、利率债久期风险\n"
+    "- **组合性价比**：\n"
+    "  • 股债净资产比价(E/P - 10年国债收益率)\n"
+    "  • 场内基金需分析折溢价率(＞1%警惕高估)\n"
+    "- **绝对价值锚点**：给出合理净值区间依据：\n"
+    "  当前净值水平 vs 历史波动区间(30%分位以下为低估)\n\n"
+
+    "### 五、投资决策建议\n"
+    "- **建议逻辑**：\n"
+    "  • 综合夏普比率＞1.2+卡玛比率＞0.7+净值处30%分位→'买入'\n"
+    "  • 规模激增(＞100亿)+重仓股估值＞70%分位→'减持'\n"
+    "- **强制输出**：中文操作建议(买入/增持/持有/减持/卖出)\n"
+
+    "🚫 **禁止事项**：\n"
+    "- 禁止假设数据\n"
+    "- 禁止使用英文建议(buy/sell/hold)\n"
+)
+
+_FUND_USER_PROMPT_TEMPLATE = (
+    "你现在拥有以下基金的真实数据，请严格依赖真实数据（注意！每条数据必须强制利用到来进行分析），"
+    "绝不编造其他数据，对（基金代码：{fund_symbol}）进行全面分析，给出非常详细格式化的报告:\n"
+)
+
+
+def _generate_fund_report(fund_symbol, messages, on_progress=None):
+    """流式调用大模型生成基金分析报告，每次调用都从头生成，可整体重试"""
+    responses = _get_dashscope().Generation.call(
         # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx",
         api_key=os.getenv('DASHSCOPE_API_KEY'),
         model="qwen-plus-latest",
         # 此处以qwen-plus-latest为例，可按需更换模型名称。模型列表：https://help.aliyun.com/zh/model-studio/getting-started/models
         messages=messages,
-        result_format='message'
+        result_format='message',
+        # 流式增量输出，报告生成过程中即可反馈进度
+        stream=True,
+        incremental_output=True
     )
-    print(response.output.choices[0].message.content)
 
-    return response.output.choices[0].message.content
+    chunks = []
+    generated = 0
+    for response in responses:
+        if response.status_code == HTTPStatus.TOO_MANY_REQUESTS or response.status_code >= 500:
+            raise TransientAPIError(f"大模型调用失败: {response.code} {response.message}")
+        if response.status_code != HTTPStatus.OK:
+            raise RuntimeError(f"大模型调用失败: {response.code} {response.message}")
+        chunk = response.output.choices[0].message.content
+        chunks.append(chunk)
+        generated += len(chunk)
+        if on_progress:
+            on_progress(f"基金 {fund_symbol} 报告生成中（已生成 {generated} 字）")
+
+    return "".join(chunks)
+
+
+def run_fund_analysis(fund_symbol, on_progress=None):
+    """
+    获取基金数据并调用大模型生成基金基本面分析报告
+
+    Args:
+        fund_symbol: 基金代码
+        on_progress: 进度回调，接收进度信息（str），包括报告生成进度和接口重试提示；
+            可能在数据获取的工作线程中触发
+
+    Returns:
+        (报告文本, 数据是否完整)，部分分段获取失败时仍基于已有数据生成报告，但标记为不完整
+
+    Raises:
+        RuntimeError: 所有数据分段均获取失败时
+    """
+    result, succeeded = _fetch_fund_data(fund_symbol, on_progress)
+    if succeeded == 0:
+        raise RuntimeError("基金数据获取失败（所有数据项均获取失败），请稍后重试")
+
+    logger.debug("基金 %s 数据: %s", fund_symbol, result)
+
+    system_message = _FUND_SYSTEM_TEMPLATE.format(fund_symbol=fund_symbol)
+    user_prompt = _FUND_USER_PROMPT_TEMPLATE.format(fund_symbol=fund_symbol) + result
+
+    messages = [
+        {'role': 'system', 'content': system_message},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    report = _call_with_retry(
+        _generate_fund_report, fund_symbol, messages, on_progress,
+        description=f"基金 {fund_symbol} 的报告生成", on_retry=on_progress)
+    logger.debug("基金 %s 分析报告: %s", fund_symbol, report)
+
+    return report, succeeded == len(_FUND_SECTIONS)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+planning.tool_executor 测试程序
+使用桩模块替换 streamlit 和个股分析入口，测试批量并发调度、会话级报告缓存、
+基金数据按代码查找以及临时性错误重试
+"""
+
+import sys
+import os
+import time
+import types
+import logging
+import unittest
+from unittest.mock import patch
+
+import requests
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+
+class _SessionState(dict):
+    """同时支持属性访问和字典访问的 st.session_state 替身"""
+
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+def _passthrough_cache(*args, **kwargs):
+    """st.cache_data / st.cache_resource 替身：不做缓存，直接返回被装饰函数"""
+    if args and callable(args[0]):
+        return args[0]
+    return lambda func: func
+
+
+def _stub_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def _unexpected_stock_analysis(**kwargs):
+    raise AssertionError("测试中应替换 run_stock_analysis")
+
+
+def _import_tool_executor():
+    """在桩模块环境下导入 planning.tool_executor"""
+    stubs = {
+        'streamlit': _stub_module('streamlit', cache_data=_passthrough_cache,
+                                  cache_resource=_passthrough_cache, session_state=_SessionState()),
+        'web': _stub_module('web'),
+        'web.utils': _stub_module('web.utils'),
+        'web.utils.analysis_runner': _stub_module('web.utils.analysis_runner',
+                                                  run_stock_analysis=_unexpected_stock_analysis),
+    }
+    try:
+        import docstring_parser  # noqa: F401
+    except ImportError:
+        stubs['docstring_parser'] = _stub_module(
+            'docstring_parser', parse=lambda doc: types.SimpleNamespace(short_description=doc, params=[]))
+    try:
+        import tradingagents.utils.logging_manager  # noqa: F401
+    except ImportError:
+        stubs['tradingagents'] = _stub_module('tradingagents')
+        stubs['tradingagents.utils'] = _stub_module('tradingagents.utils')
+        stubs['tradingagents.utils.logging_manager'] = _stub_module(
+            'tradingagents.utils.logging_manager', get_logger=logging.getLogger)
+    with patch.dict(sys.modules, stubs):
+        sys.modules.pop('planning.tool_executor', None)
+        from planning import tool_executor
+    return tool_executor
+
+
+try:
+    tool_executor = _import_tool_executor()
+    TOOL_EXECUTOR_AVAILABLE = True
+except ImportError as e:
+    print(f"⚠️ tool_executor 不可用: {e}")
+    TOOL_EXECUTOR_AVAILABLE = False
+
+
+def _http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status_code} Error", response=response)
+
+
+class TestRunBatch(unittest.TestCase):
+    """批量并发调度测试类"""
+
+    def setUp(self):
+        if not TOOL_EXECUTOR_AVAILABLE:
+            self.skipTest("tool_executor 不可用")
+
+    def test_results_keep_input_order(self):
+        """完成顺序与输入顺序不同时，结果仍按输入顺序返回"""
+        symbols = ['000001', '000002', '000003', '000004']
+        delays = {'000001': 0.2, '000002': 0.0, '000003': 0.1, '000004': 0.05}
+
+        def worker(code, notify):
+            time.sleep(delays[code])
+            return f"report-{code}"
+
+        results = tool_executor.ToolExecutor._run_batch(symbols, worker, "股票", None)
+        self.assertEqual(results, [f"report-{code}" for code in symbols])
+
+    def test_exceptions_land_in_their_slots(self):
+        """单个标的失败时，异常对象出现在该标的对应的位置，不影响其他标的"""
+        symbols = ['000001', '000002', '000003']
+
+        def worker(code, notify):
+            if code == '000002':
+                raise RuntimeError("boom")
+            return code
+
+        results = tool_executor.ToolExecutor._run_batch(symbols, worker, "股票", None)
+        self.assertEqual(results[0], '000001')
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual(str(results[1]), "boom")
+        self.assertEqual(results[2], '000003')
+
+    def test_progress_is_monotonic(self):
+        """进度值单调不减并最终到达 1，开始与完成提示覆盖每个标的"""
+        symbols = [f"{i:06d}" for i in range(1, 9)]
+        progress = []
+
+        def worker(code, notify):
+            notify(f"{code} 处理中")
+            time.sleep(0.01 * (int(code) % 3))
+            return code
+
+        with patch.object(tool_executor, 'MAX_CONCURRENT_ANALYSES', 3):
+            tool_executor.ToolExecutor._run_batch(
+                symbols, worker, "股票", lambda message, value: progress.append((message, value)))
+
+        values = [value for _, value in progress]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(values[-1], 1)
+        messages = [message for message, _ in progress]
+        for code in symbols:
+            self.assertIn(f"{code} 处理中", messages)
+            self.assertTrue(any(m.startswith(f"正在分析股票 {code}") for m in messages))
+            self.assertTrue(any(m.startswith(f"已完成股票 {code}") for m in messages))
+
+
+class TestStockReportCache(unittest.TestCase):
+    """会话级个股报告缓存测试类"""
+
+    def setUp(self):
+        if not TOOL_EXECUTOR_AVAILABLE:
+            self.skipTest("tool_executor 不可用")
+        self.session_state = _SessionState(llm_config={})
+        self.analyzed = []
+        self.failing = set()
+
+        def run_stock_analysis(stock_symbol, **kwargs):
+            self.analyzed.append(stock_symbol)
+            if stock_symbol in self.failing:
+                raise RuntimeError("数据源不可用")
+            return {'state': {'market_report': f"市场-{stock_symbol}"}, 'decision': {'reasoning': '理由'}}
+
+        patchers = [
+            patch.object(tool_executor.st, 'session_state', self.session_state),
+            patch.object(tool_executor, 'run_stock_analysis', run_stock_analysis),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.executor = tool_executor.ToolExecutor()
+
+    def _analyze(self, symbols):
+        return self.executor.execute_stock_analysis_tool({'stock_symbols': symbols}, "")
+
+    def test_only_pending_symbols_are_analyzed(self):
+        """已缓存的标的不再重复分析，只分析新增标的"""
+        first = self._analyze(['000001', '000002'])
+        self.assertEqual(sorted(self.analyzed), ['000001', '000002'])
+
+        self.analyzed.clear()
+        second = self._analyze(['000002', '000003', '000001'])
+        self.assertEqual(self.analyzed, ['000003'])
+        self.assertIn("市场-000001", first)
+        # 缓存命中与新分析的报告按（排序后的）代码顺序拼接
+        self.assertLess(second.index("个股分析: 000001"), second.index("个股分析: 000002"))
+        self.assertLess(second.index("个股分析: 000002"), second.index("个股分析: 000003"))
+
+    def test_failures_are_not_cached(self):
+        """分析失败的标的不写入缓存，下次调用时重新分析"""
+        self.failing.add('000002')
+        report = self._analyze(['000001', '000002'])
+        self.assertIn("个股分析: 000002\n分析失败", report)
+
+        self.analyzed.clear()
+        self.failing.clear()
+        report = self._analyze(['000001', '000002'])
+        self.assertEqual(self.analyzed, ['000002'])
+        self.assertIn("市场-000002", report)
+
+
+class TestLookupByCode(unittest.TestCase):
+    """基金全市场数据按代码查找测试类"""
+
+    def setUp(self):
+        if not TOOL_EXECUTOR_AVAILABLE:
+            self.skipTest("tool_executor 不可用")
+        if not PANDAS_AVAILABLE:
+            self.skipTest("pandas 不可用")
+        self.df = pd.DataFrame({
+            '代码': ['000001', '000002', '000002'],
+            '评级': ['5星', '4星', '3星'],
+        }).set_index('代码', drop=False)
+
+    def test_missing_code_returns_empty_frame(self):
+        """不存在的代码返回保留列结构的空表"""
+        result = tool_executor._lookup_by_code(self.df, '999999')
+        self.assertTrue(result.empty)
+        self.assertEqual(list(result.columns), ['代码', '评级'])
+
+    def test_duplicate_codes_return_all_rows(self):
+        """同一代码有多行时全部返回"""
+        result = tool_executor._lookup_by_code(self.df, '000002')
+        self.assertEqual(list(result['评级']), ['4星', '3星'])
+
+    def test_single_code_returns_frame(self):
+        """唯一代码也返回 DataFrame 而不是 Series"""
+        result = tool_executor._lookup_by_code(self.df, '000001')
+        self.assertIsInstance(result, pd.DataFrame)
+        self.assertEqual(list(result['评级']), ['5星'])
+
+
+class TestRetry(unittest.TestCase):
+    """临时性错误重试测试类"""
+
+    def setUp(self):
+        if not TOOL_EXECUTOR_AVAILABLE:
+            self.skipTest("tool_executor 不可用")
+        patcher = patch.object(tool_executor, '_RETRY_BACKOFF', lambda retry_state: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_is_transient_error(self):
+        """限流、服务端错误、网络错误可重试，其余错误不重试"""
+        self.assertTrue(tool_executor._is_transient_error(tool_executor.TransientAPIError("限流")))
+        self.assertTrue(tool_executor._is_transient_error(requests.ConnectionError()))
+        self.assertTrue(tool_executor._is_transient_error(requests.Timeout()))
+        self.assertTrue(tool_executor._is_transient_error(_http_error(429)))
+        self.assertTrue(tool_executor._is_transient_error(_http_error(503)))
+        self.assertFalse(tool_executor._is_transient_error(_http_error(404)))
+        self.assertFalse(tool_executor._is_transient_error(requests.HTTPError("no response")))
+        self.assertFalse(tool_executor._is_transient_error(ValueError("bad json")))
+
+    def test_retries_transient_errors_until_success(self):
+        """临时性错误重试直至成功，每次重试都通过 on_retry 反馈"""
+        calls = []
+        messages = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise requests.ConnectionError("连接中断")
+            return "ok"
+
+        result = tool_executor._call_with_retry(flaky, description="基金 000001 的基本数据",
+                                                on_retry=messages.append)
+        self.assertEqual(result, "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith("基金 000001 的基本数据请求失败（连接中断）"))
+        self.assertIn("第1次重试", messages[0])
+        self.assertIn("第2次重试", messages[1])
+
+    def test_gives_up_after_max_attempts(self):
+        """重试次数耗尽后抛出最后一次的异常"""
+        calls = []
+
+        def always_down():
+            calls.append(1)
+            raise tool_executor.TransientAPIError("服务不可用")
+
+        with self.assertRaises(tool_executor.TransientAPIError):
+            tool_executor._call_with_retry(always_down)
+        self.assertEqual(len(calls), tool_executor.RETRY_MAX_ATTEMPTS)
+
+    def test_does_not_retry_permanent_errors(self):
+        """非临时性错误直接抛出，不重试"""
+        calls = []
+
+        def bad_request():
+            calls.append(1)
+            raise _http_error(400)
+
+        with self.assertRaises(requests.HTTPError):
+            tool_executor._call_with_retry(bad_request)
+        self.assertEqual(len(calls), 1)
+
+    def test_retry_after_header_is_honoured(self):
+        """HTTP 错误带 Retry-After 时按其等待，并受上限约束"""
+        waits = []
+
+        def rate_limited():
+            if len(waits) < 2:
+                raise _http_error(429, {'Retry-After': '2' if not waits else '600'})
+            return "ok"
+
+        with patch('tenacity.nap.time.sleep', waits.append):
+            self.assertEqual(tool_executor._call_with_retry(rate_limited), "ok")
+        self.assertEqual(waits, [2.0, tool_executor._RETRY_AFTER_MAX_SECONDS])
+
+
+if __name__ == '__main__':
+    unittest.main()